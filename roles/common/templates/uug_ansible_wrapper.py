@@ -11,12 +11,14 @@ URL to pull from can be changed in the program's Settings.
 
 import ast
 import functools
+import http.client
 import logging
 import os
 import pathlib
 import re
-import subprocess
-import urllib.error
+import shutil
+import threading
+import time
 import urllib.request
 import webbrowser
 from tempfile import TemporaryDirectory
@@ -24,6 +26,12 @@ from tempfile import TemporaryDirectory
 import yaml
 from xdg import BaseDirectory
 
+# Use the much faster LibYAML-based loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 import gi
 
 gi.require_version("Gtk", "3.0")
@@ -31,9 +39,21 @@ gi.require_version("Vte", "2.91")
 # pygobject best practice, unfortunately, is to do the import after calling the
 # require_version() function. This triggers a pylint message.
 # pylint: disable=wrong-import-position
-from gi.repository import Gtk, Vte, GLib
+from gi.repository import Gio, Gtk, Vte, GLib
 
 DEFAULT_GIT_REMOTE = "https://github.com/jmunixusers/cs-vm-build"
+# Resolve git once rather than on every branch check. If it cannot be found,
+# fall back to the usual location so that the failure to run it is logged.
+GIT_PATH = shutil.which("git") or "/usr/bin/git"
+# Successful branch and connectivity checks are remembered for this many
+# seconds so that clicking Run repeatedly does not repeat them. The caches
+# map (git URL, branch) and the connectivity URL to the time of the check.
+CHECK_CACHE_TTL = 30
+BRANCH_CACHE = {}
+ONLINE_CACHE = {}
+# Matches a KEY=value assignment in os-release. Blank lines and comments do
+# not match since the key must start with a letter or underscore.
+OS_RELEASE_LINE = re.compile(r"^[ \t]*([A-Za-z_][A-Za-z0-9_]*)=(.*?)[ \t\r]*$", re.MULTILINE)
 
 # If no tags are passed to ansible-pull, all of them will be run and I am
 # uncertain of the outcome of passing -t with no tags. To avoid this, always
@@ -50,6 +70,10 @@ COURSES = {
     "CS 432": "cs432",
 }
 EXPERIMENTAL_COURSES = {}
+# The courses are displayed in sorted order; since the maps above never
+# change, sort them once rather than every time the checkboxes are rebuilt
+SORTED_COURSES = tuple(sorted(COURSES.items()))
+SORTED_EXPERIMENTAL_COURSES = tuple(sorted(EXPERIMENTAL_COURSES.items()))
 USER_CONFIG = {
     "git_branch": None,
     "git_url": DEFAULT_GIT_REMOTE,
@@ -63,6 +87,134 @@ USER_CONFIG = {
 APP_NAME = "cs-vm-build"
 NAME = "JMU CS VM Configuration"
 VERSION = "2022.08"
+LOGGER = logging.getLogger("uug_ansible_wrapper")
+
+# Layout of the main window. The course checkboxes and the terminal are added
+# to this when the window is created.
+MAIN_WINDOW_UI = """<?xml version="1.0" encoding="UTF-8"?>
+<interface>
+  <requires lib="gtk+" version="3.20"/>
+  <object class="GtkBox" id="main_box">
+    <property name="orientation">vertical</property>
+    <child>
+      <object class="GtkMenuBar">
+        <child>
+          <object class="GtkMenuItem">
+            <property name="label">File</property>
+            <child type="submenu">
+              <object class="GtkMenu">
+                <child>
+                  <object class="GtkMenuItem" id="settings_item">
+                    <property name="label">Settings&#x2026;</property>
+                    <signal name="activate" handler="on_settings_activate"/>
+                  </object>
+                </child>
+                <child>
+                  <object class="GtkMenuItem">
+                    <property name="label">Quit</property>
+                    <signal name="activate" handler="on_quit"/>
+                  </object>
+                </child>
+              </object>
+            </child>
+          </object>
+        </child>
+        <child>
+          <object class="GtkMenuItem">
+            <property name="label">Help</property>
+            <child type="submenu">
+              <object class="GtkMenu">
+                <child>
+                  <object class="GtkMenuItem">
+                    <property name="label">About</property>
+                    <signal name="activate" handler="on_about_activate"/>
+                  </object>
+                </child>
+                <child>
+                  <object class="GtkMenuItem">
+                    <property name="label">Documentation</property>
+                    <signal name="activate" handler="on_documentation_activate"/>
+                  </object>
+                </child>
+              </object>
+            </child>
+          </object>
+        </child>
+      </object>
+      <packing>
+        <property name="expand">False</property>
+        <property name="fill">False</property>
+      </packing>
+    </child>
+    <child>
+      <object class="GtkBox" id="contents_box">
+        <property name="orientation">vertical</property>
+        <property name="spacing">12</property>
+        <property name="border-width">10</property>
+        <child>
+          <object class="GtkLabel">
+            <property name="label">Select the course configurations to add/update (at this time courses cannot be removed).</property>
+            <property name="xalign">0</property>
+            <property name="yalign">0</property>
+          </object>
+          <packing>
+            <property name="expand">False</property>
+            <property name="fill">False</property>
+          </packing>
+        </child>
+        <child>
+          <object class="GtkBox" id="courses_box">
+            <property name="orientation">vertical</property>
+            <property name="spacing">6</property>
+          </object>
+          <packing>
+            <property name="expand">False</property>
+            <property name="fill">False</property>
+          </packing>
+        </child>
+        <child>
+          <object class="GtkBox">
+            <property name="spacing">6</property>
+            <child>
+              <object class="GtkButton" id="run_button">
+                <property name="label">Run</property>
+                <property name="tooltip-text">Configure the VM</property>
+                <signal name="clicked" handler="on_run_clicked"/>
+              </object>
+              <packing>
+                <property name="expand">True</property>
+                <property name="fill">True</property>
+              </packing>
+            </child>
+            <child>
+              <object class="GtkButton" id="cancel_button">
+                <property name="label">_Quit</property>
+                <property name="use-underline">True</property>
+                <signal name="clicked" handler="on_quit"/>
+              </object>
+              <packing>
+                <property name="expand">True</property>
+                <property name="fill">True</property>
+                <property name="pack-type">end</property>
+              </packing>
+            </child>
+          </object>
+          <packing>
+            <property name="expand">False</property>
+            <property name="fill">True</property>
+            <property name="pack-type">end</property>
+          </packing>
+        </child>
+      </object>
+      <packing>
+        <property name="expand">True</property>
+        <property name="fill">True</property>
+        <property name="pack-type">end</property>
+      </packing>
+    </child>
+  </object>
+</interface>
+"""
 
 
 def main():
@@ -85,39 +237,19 @@ def main():
         )
     except OSError:
         logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
-        logging.error(
+        LOGGER.error(
             "Unable to open log file at %s. Logging on console instead",
             user_log_file,
         )
 
-    # The default value for the branch is the current distro release name.
-    # Set this before parsing the configuration. If it can't be detected,
-    # it should get set to None. If the branch does not currently exist, it
-    # should be set to main.
-    distro_name = get_distro_release_name()
-    if branch_exists(distro_name):
-        USER_CONFIG["git_branch"] = distro_name
-    else:
-        USER_CONFIG["git_branch"] = "main"
-
-    # Parse the user's previous settings
-    parse_user_config()
-
-    # If common got removed from the configuration, add it back to prevent
-    # potentially bad things from happening
-    if "common" not in USER_CONFIG["roles_this_run"]:
-        USER_CONFIG["roles_this_run"].append("common")
-
-    if not USER_CONFIG["git_branch"]:
-        USER_CONFIG["git_branch"] = "main"
-
-    # Show the window and ensure when it's closed that the script terminates
+    # Show the window right away; its controls are enabled once the user's
+    # settings have been loaded
     win = AnsibleWrapperWindow()
     win.connect("delete-event", Gtk.main_quit)
     win.show_all()
+    win.set_controls_sensitive(False)
 
-    if not validate_branch_settings(win):
-        logging.warning("Non-optimal user branch settings.")
+    load_settings_async(win)
 
     Gtk.main()
 
@@ -137,43 +269,32 @@ class AnsibleWrapperWindow(Gtk.Window):
         try:
             self.set_icon_name("{{ common_tux_icon_name }}")
         except GLib.GError as err:
-            logging.warning("Unable to set Tux icon", exc_info=err)
-
-        # Create a box to contain all elements that will be added to the window
-        self.vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
-        self.add(self.vbox)
-
-        self.create_toolbar()
-
-        contents = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
-        contents.set_border_width(10)
-
-        instruction_text = (
-            "Select the course configurations to add/update"
-            " (at this time courses cannot be removed)."
+            LOGGER.warning("Unable to set Tux icon", exc_info=err)
+
+        # The static layout is described by MAIN_WINDOW_UI; only the widgets
+        # that depend on runtime state are created here
+        builder = Gtk.Builder.new_from_string(MAIN_WINDOW_UI, -1)
+        builder.connect_signals(
+            {
+                "on_settings_activate": self.show_settings,
+                "on_quit": Gtk.main_quit,
+                "on_about_activate": self.show_about_dialog,
+                "on_documentation_activate": lambda _: webbrowser.open(
+                    "http://www.jmunixusers.org/presentations/vm/"
+                ),
+                "on_run_clicked": self.on_run_clicked,
+            }
         )
-        label = Gtk.Label(label=instruction_text)
-        label.set_xalign(0.0)
-        label.set_yalign(0.0)
+        self.add(builder.get_object("main_box"))
 
-        contents.pack_start(label, False, False, 0)
-
-        self.courses_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self.courses_box = builder.get_object("courses_box")
         self.add_all_courses()
-        contents.pack_start(self.courses_box, False, False, 0)
-
-        # Add run and cancel buttons
-        button_box = Gtk.Box(spacing=6)
-        self.run_button = Gtk.Button.new_with_label("Run")
-        self.run_button.set_tooltip_text("Configure the VM")
-        self.run_button.connect("clicked", self.on_run_clicked)
-        button_box.pack_start(self.run_button, True, True, 0)
-        self.cancel_button = Gtk.Button.new_with_mnemonic("_Quit")
-        self.cancel_button.connect("clicked", Gtk.main_quit)
-        button_box.pack_end(self.cancel_button, True, True, 0)
-        contents.pack_end(button_box, False, True, 0)
-
-        # Add the terminal to the window
+
+        self.settings_item = builder.get_object("settings_item")
+        self.run_button = builder.get_object("run_button")
+        self.cancel_button = builder.get_object("cancel_button")
+
+        # Add the terminal to the window, above the run and cancel buttons
         self.terminal = Vte.Terminal()
         # Prevent the user from entering text or ^C
         self.terminal.set_input_enabled(False)
@@ -182,8 +303,7 @@ class AnsibleWrapperWindow(Gtk.Window):
         # Ensure that all lines can be seen (default is only 512)
         self.terminal.set_scrollback_lines(-1)
         self.terminal.connect("child-exited", self.sub_command_exited)
-        contents.pack_end(self.terminal, True, True, 0)
-        self.vbox.pack_end(contents, True, True, 0)
+        builder.get_object("contents_box").pack_end(self.terminal, True, True, 0)
 
     def add_all_courses(self):
         """
@@ -209,82 +329,37 @@ class AnsibleWrapperWindow(Gtk.Window):
             self.courses_box.pack_start(checkbox, False, False, 0)
             if tag in USER_CONFIG["roles_this_run"]:
                 checkbox.set_active(True)
-            checkbox.connect("toggled", self.on_course_toggled, tag)
-            self.checkboxes.append(checkbox)
+            self.checkboxes.append((tag, checkbox))
 
-        # Add a checkbox for every course; sorting is necessary because
-        # dictionaries do not guarantee that order is preserved
-        for (course, tag) in sorted(COURSES.items()):
+        # Add a checkbox for every course in alphabetical order
+        for course, tag in SORTED_COURSES:
             add_course(course, tag, experimental=False)
         if USER_CONFIG["allow_experimental"]:
-            for (course, tag) in sorted(EXPERIMENTAL_COURSES.items()):
+            for course, tag in SORTED_EXPERIMENTAL_COURSES:
                 add_course(f"{course} ⚠️Experimental⚠️", tag, experimental=True)
         self.courses_box.show_all()
 
-    @classmethod
-    def on_course_toggled(cls, button, name):
-        """
-        Adds the course to or removes the course from the list of courses to
-        provision based on whether the checkbox was checked or unchecked
-        respectively.
-        :param button: The checkbox that triggered the action
-        :param name: The name of the course associated with button
-        """
-
-        if button.get_active():
-            USER_CONFIG["roles_this_run"].append(name)
-        else:
-            USER_CONFIG["roles_this_run"].remove(name)
-
-    def create_toolbar(self):
+    def update_selected_roles(self):
         """
-        Initializes the window's toolbar.
+        Updates the list of roles to provision based on which course
+        checkboxes are checked. Roles without a checkbox are left as-is.
         """
 
-        menu_bar = Gtk.MenuBar()
-
-        # Create the File menu
-        file_menu = Gtk.Menu()
-        file_item = Gtk.MenuItem(label="File")
-        file_item.set_submenu(file_menu)
-
-        # Add settings and quit items to the File menu
-        settings = Gtk.MenuItem(label="Settings\u2026")
-        settings.connect("activate", self.show_settings)
-        file_menu.append(settings)
-        quit_item = Gtk.MenuItem(label="Quit")
-        quit_item.connect("activate", Gtk.main_quit)
-        file_menu.append(quit_item)
-
-        menu_bar.append(file_item)
-
-        # Create the Help menu
-        help_menu = Gtk.Menu()
-        help_item = Gtk.MenuItem(label="Help")
-        help_item.set_submenu(help_menu)
-
-        # Add about item to the Help menu
-        about = Gtk.MenuItem(label="About")
-        about.connect("activate", self.show_about_dialog)
-        help_menu.append(about)
-
-        # Add a documentation link to the help menu
-        docs = Gtk.MenuItem(label="Documentation")
-        docs.connect(
-            "activate",
-            lambda _: webbrowser.open("http://www.jmunixusers.org/presentations/vm/"),
-        )
-        help_menu.append(docs)
-
-        menu_bar.append(help_item)
-
-        self.vbox.pack_start(menu_bar, False, False, 0)
+        course_tags = [tag for tag, _ in self.checkboxes]
+        roles = [
+            role for role in USER_CONFIG["roles_this_run"] if role not in course_tags
+        ]
+        roles += [tag for tag, checkbox in self.checkboxes if checkbox.get_active()]
+        USER_CONFIG["roles_this_run"] = roles
 
     def show_settings(self, _):
         """
         Displays a dialog for changing the program's settings.
         """
 
+        # The courses are rebuilt if the settings change; ensure that the
+        # current selections are kept (and saved) when that happens
+        self.update_selected_roles()
         dialog = SettingsDialog(parent=self)
         response = dialog.run()
         if response == Gtk.ResponseType.OK:
@@ -314,16 +389,26 @@ class AnsibleWrapperWindow(Gtk.Window):
         about_dialog.connect("response", on_dialog_close)
         about_dialog.show()
 
+    def set_controls_sensitive(self, sensitive):
+        """
+        Enables or disables the run and quit buttons, the settings menu item
+        and all of the course checkboxes.
+        :param sensitive: Whether the controls should accept input
+        """
+
+        for _, checkbox in self.checkboxes:
+            checkbox.set_sensitive(sensitive)
+        self.settings_item.set_sensitive(sensitive)
+        self.cancel_button.set_sensitive(sensitive)
+        self.run_button.set_sensitive(sensitive)
+
     def sub_command_exited(self, _, exit_status):
         """
         Displays a dialog informing the user whether the pkexec and
         ansible-pull commands completely successfully or not.
         """
 
-        for checkbox in self.checkboxes:
-            checkbox.set_sensitive(True)
-        self.cancel_button.set_sensitive(True)
-        self.run_button.set_sensitive(True)
+        self.set_controls_sensitive(True)
         if exit_status == 0:
             success_msg = "Your machine has been configured for " + ", ".join(
                 sorted(USER_CONFIG["roles_this_run"])
@@ -335,7 +420,7 @@ class AnsibleWrapperWindow(Gtk.Window):
                 "Complete",
                 success_msg,
             )
-            logging.info("ansible-pull succeeded")
+            LOGGER.info("ansible-pull succeeded")
         # 126 should be the exit code if the pkexec dialog is dismissed and
         # 127 is the exit code if authentication fails. All other exit codes
         # come from the called application
@@ -356,7 +441,7 @@ class AnsibleWrapperWindow(Gtk.Window):
                 "Unable to authenticate",
                 pkexec_err_msg,
             )
-            logging.warning("User dismissed authentication dialog")
+            LOGGER.warning("User dismissed authentication dialog")
         elif exit_status in (127, 32512):
             pkexec_err_msg = (
                 "Unable to authenticate due to an incorrect"
@@ -370,7 +455,7 @@ class AnsibleWrapperWindow(Gtk.Window):
                 "Unable to authenticate",
                 pkexec_err_msg,
             )
-            logging.error("Unable to authenticate user")
+            LOGGER.error("Unable to authenticate user")
         else:
             ansible_err_msg = (
                 "There was an error while running the configuration tasks. "
@@ -386,7 +471,7 @@ class AnsibleWrapperWindow(Gtk.Window):
                 "Error",
                 ansible_err_msg,
             )
-            logging.error("ansible-pull failed")
+            LOGGER.error("ansible-pull failed")
 
     def on_run_clicked(self, _):
         """
@@ -394,7 +479,32 @@ class AnsibleWrapperWindow(Gtk.Window):
         and quit buttons are disabled as are all the checkboxes.
         """
 
-        if not is_online():
+        self.update_selected_roles()
+        self.set_controls_sensitive(False)
+
+        # Start checking the branch in the background so that the network
+        # round-trip overlaps with the connectivity check below. The result
+        # is delivered from the main loop, which cannot happen until this
+        # returns, so the callback sees the result of this click's
+        # connectivity check, or False if the check never completed. Either
+        # way, on_checks_finished() re-enables the controls if it can't run.
+        online = False
+
+        def on_branch_checked(branch_found):
+            self.on_checks_finished(online, branch_found)
+
+        branch_exists_async(USER_CONFIG["git_branch"], on_branch_checked)
+        online = is_online()
+
+    def on_checks_finished(self, online, branch_found):
+        """
+        Called once the background branch check has completed. Runs the
+        ansible-pull command if all of the checks succeeded.
+        :param online: Whether the Internet connectivity check succeeded
+        :param branch_found: Whether the chosen branch exists on the remote
+        """
+
+        if not online:
             no_internet_msg = (
                 "It appears that you are not able to access the Internet. "
                 "This tool requires that you be online. "
@@ -408,21 +518,17 @@ class AnsibleWrapperWindow(Gtk.Window):
                 "No Internet connection",
                 no_internet_msg,
             )
+            self.set_controls_sensitive(True)
             return
 
-        if not branch_exists(USER_CONFIG["git_branch"]):
+        if not branch_found:
             invalid_branch(self)
+            self.set_controls_sensitive(True)
             return
 
-        for checkbox in self.checkboxes:
-            checkbox.set_sensitive(False)
-
-        self.cancel_button.set_sensitive(False)
-        self.run_button.set_sensitive(False)
-
         write_user_config()
 
-        logging.info(
+        LOGGER.info(
             "Running ansible-pull with flags: %s",
             ",".join(USER_CONFIG["roles_this_run"]),
         )
@@ -482,7 +588,7 @@ class AnsibleWrapperWindow(Gtk.Window):
                     None,
                 )
             except GLib.Error as error:
-                logging.error("Unable to run ansible command.", exc_info=error)
+                LOGGER.error("Unable to run ansible command.", exc_info=error)
                 self.sub_command_exited(None, 1)
 
 
@@ -660,20 +766,17 @@ def show_dialog(parent, dialog_type, buttons_type, header, message):
     return response
 
 
-def parse_json_config(path: pathlib.Path, config):
+def parse_json_config(contents: bytes, config):
     """
-    Loads the data in the file at the provided path into a dictionary.
-    :param path: The path to the JSON file
+    Loads the data from the contents of a configuration file into a dictionary.
+    :param contents: The contents of the JSON file
     :param config: The dictionary to update with data from the JSON file
     """
 
     try:
-        with open(path, "r", encoding="utf-8") as config_file:
-            config.update(yaml.safe_load(config_file))
-    except FileNotFoundError as fne:
-        logging.info("User configuration file not present. Ignoring.", exc_info=fne)
+        config.update(yaml.load(contents, Loader=SafeLoader))
     except yaml.YAMLError as jde:
-        logging.info("User configuration is invalid. Ignoring.", exc_info=jde)
+        LOGGER.info("User configuration is invalid. Ignoring.", exc_info=jde)
 
 
 def write_json_config(path: pathlib.Path, config):
@@ -694,43 +797,118 @@ def write_json_config(path: pathlib.Path, config):
         def increase_indent(self, flow=False, indentless=False):
             return super().increase_indent(flow=flow, indentless=False)
 
-    with open(path, "w", encoding="utf-8") as config_file:
-        # Make the written file relatively readable & writable by users
-        yaml.dump(
-            config,
-            config_file,
-            Dumper=IndentingSafeDumper,
-            default_flow_style=False,
-            encoding="utf-8",
-            explicit_start=True,
-        )
+    # Make the written file relatively readable & writable by users
+    contents = yaml.dump(
+        config,
+        Dumper=IndentingSafeDumper,
+        default_flow_style=False,
+        encoding="utf-8",
+        explicit_start=True,
+    )
+
+    # Most runs do not change the configuration, so avoid rewriting it
+    try:
+        if path.read_bytes() == contents:
+            LOGGER.debug("Configuration at %s is unchanged", path)
+            return
+    except FileNotFoundError:
+        pass
+
+    # Write to a temporary file and move it into place so that the
+    # configuration is never left partially written
+    temp_path = path.with_name(path.name + ".tmp")
+    temp_path.write_bytes(contents)
+    os.replace(temp_path, path)
 
 
-def parse_user_config():
+def parse_user_config_async(callback):
     """
-    Loads a user's configuration.
+    Loads a user's configuration without blocking the GTK main loop.
+    :param callback: Called from the main loop once the configuration has
+                     been loaded
     """
 
     config_dir = BaseDirectory.load_first_config(APP_NAME)
+
+    def finish():
+        USER_CONFIG["roles_all_time"] = list(dict.fromkeys(USER_CONFIG["roles_all_time"]))
+        # Remove duplicates from roles for this run
+        USER_CONFIG["roles_this_run"] = list(
+            dict.fromkeys(USER_CONFIG["roles_this_run"] + USER_CONFIG["roles_all_time"])
+        )
+
+        LOGGER.info("Read config: %s from %s", USER_CONFIG, config_dir)
+        callback()
+
+    def on_loaded(config_file, result):
+        try:
+            _, contents, _ = config_file.load_contents_finish(result)
+        except GLib.Error as error:
+            LOGGER.info("User configuration file not present. Ignoring.", exc_info=error)
+        else:
+            parse_json_config(contents, USER_CONFIG)
+        finish()
+
     if config_dir:
         config_path = pathlib.Path(config_dir) / "settings.yml"
-        parse_json_config(config_path, USER_CONFIG)
+        Gio.File.new_for_path(str(config_path)).load_contents_async(None, on_loaded)
     else:
-        logging.info("User configuration has not been created yet")
+        LOGGER.info("User configuration has not been created yet")
+        GLib.idle_add(finish)
 
-    USER_CONFIG["roles_all_time"] = list(set(USER_CONFIG["roles_all_time"]))
-    USER_CONFIG["roles_this_run"] += USER_CONFIG["roles_all_time"]
-    # Remove duplicates from roles for this run
-    USER_CONFIG["roles_this_run"] = list(set(USER_CONFIG["roles_this_run"]))
 
-    logging.info("Read config: %s from %s", USER_CONFIG, config_dir)
+def load_settings_async(win):
+    """
+    Loads the user's settings and determines the default branch without
+    blocking the GTK main loop, then enables the window's controls.
+    :param win: The main window
+    """
 
+    # The default value for the branch is the current distro release name.
+    # If the branch does not currently exist, it should be set to main. The
+    # branch is looked up on the default remote while the user's previous
+    # settings are loaded; a branch from those settings takes precedence.
+    distro_name = get_distro_release_name()
+    results = {}
 
-@functools.lru_cache
-def parse_os_release():
+    def finish():
+        # Wait for both the branch lookup and the settings
+        if len(results) < 2:
+            return
+
+        if USER_CONFIG["git_branch"] is None:
+            USER_CONFIG["git_branch"] = distro_name if results["distro_exists"] else "main"
+
+        # If common got removed from the configuration, add it back to prevent
+        # potentially bad things from happening
+        if "common" not in USER_CONFIG["roles_this_run"]:
+            USER_CONFIG["roles_this_run"].append("common")
+
+        if not USER_CONFIG["git_branch"]:
+            USER_CONFIG["git_branch"] = "main"
+
+        win.add_all_courses()
+        win.set_controls_sensitive(True)
+
+        validate_branch_settings(win)
+
+    def on_distro_checked(exists):
+        results["distro_exists"] = exists
+        finish()
+
+    def on_config_loaded():
+        results["config_loaded"] = True
+        finish()
+
+    branch_exists_async(distro_name, on_distro_checked, DEFAULT_GIT_REMOTE)
+    parse_user_config_async(on_config_loaded)
+
+
+def _os_release_items():
     """
-    Loads the data in /etc/os-release.
-    :returns: A dictionary with the data parsed from /etc/os-release
+    Parses the os-release file. This method of parsing is based on the
+    example at https://www.freedesktop.org/software/systemd/man/os-release.html
+    :returns: A generator of (key, value) tuples in the order they appear
     """
 
     # Set os_release_file to the first item in the list that exists
@@ -738,24 +916,61 @@ def parse_os_release():
         file for file in ["/etc/os-release", "/usr/lib/os-release"]
         if os.path.exists(file)
     ][0]
-    os_release_contents = {}
     # os-release(5) specifies that it is expected that the strings in
     # this file are UTF-8 encoding
-    with open(os_release_file, encoding="utf-8") as os_release:
-        # This method of parsing is based on the example at
-        # https://www.freedesktop.org/software/systemd/man/os-release.html
-        for line in os_release:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            if match := re.match(r"([A-Z][A-Z_0-9]+)=(.*)", line):
-                key, value = match.groups()
-                # Parse string values correctly
-                if value and value[0] in ["'", '"']:
-                    value = ast.literal_eval(value)
-                os_release_contents[key] = value
-
-    return os_release_contents
+    contents = read_small_file(os_release_file)
+    for match in OS_RELEASE_LINE.finditer(contents):
+        key, value = match.groups()
+        # Parse string values correctly
+        if value and value[0] in ["'", '"']:
+            value = ast.literal_eval(value)
+        yield key, value
+
+
+@functools.lru_cache
+def parse_os_release():
+    """
+    Loads the data in /etc/os-release.
+    :returns: A dictionary with the data parsed from /etc/os-release
+    """
+
+    return dict(_os_release_items())
+
+
+@functools.lru_cache
+def get_os_release_value(wanted_key):
+    """
+    Finds a single value in /etc/os-release. Parsing stops at the first line
+    with the given key, so unlike parse_os_release() the rest of the file
+    is not processed.
+    :param wanted_key: The key to look up
+    :returns: The value for the key or None if it is not present
+    """
+
+    for key, value in _os_release_items():
+        if key == wanted_key:
+            return value
+    return None
+
+
+def read_small_file(path, chunk_size=8192):
+    """
+    Reads the entire contents of a small UTF-8 text file. This bypasses
+    Python's buffered text IO, which is unnecessary for files that fit in a
+    single read.
+    :param path: The path to the file
+    :param chunk_size: The number of bytes to request per read
+    :returns: The decoded contents of the file
+    """
+
+    chunks = []
+    file_descriptor = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        while chunk := os.read(file_descriptor, chunk_size):
+            chunks.append(chunk)
+    finally:
+        os.close(file_descriptor)
+    return b"".join(chunks).decode("utf-8")
 
 
 def get_distro_release_name():
@@ -767,50 +982,82 @@ def get_distro_release_name():
     :returns: The name of the Linux distro's release
     """
 
-    release = ""
-
-    os_release_config = parse_os_release()
-    if "VERSION_CODENAME" in os_release_config:
-        release = os_release_config["VERSION_CODENAME"]
-    else:
-        logging.debug(
-            "VERSION_CODENAME is not in /etc/os_release. Full file contents: %s",
-            os_release_config,
-        )
+    release = get_os_release_value("VERSION_CODENAME")
+    if release is None:
+        release = ""
+        # The full file is only worth parsing when it will be logged
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(
+                "VERSION_CODENAME is not in /etc/os_release. Full file contents: %s",
+                parse_os_release(),
+            )
 
     if release.lstrip() == "" or release is None:
-        logging.warning("No valid release was detected")
+        LOGGER.warning("No valid release was detected")
 
     return release
 
 
 def validate_branch_settings(parent):
     """
-    Warns the user of an error in the settings of the VM configuration.
-    :returns: a boolean indicating if the system should return or continue
+    Warns the user of an error in the settings of the VM configuration. The
+    branches are looked up without blocking the GTK main loop; any warning is
+    shown once both lookups have completed.
+    :param parent: The parent GTK window for the warning dialog
     """
 
     system_version = get_distro_release_name()
     chosen_branch = USER_CONFIG["git_branch"]
     chosen_remote = USER_CONFIG["git_url"]
-    main_okay = USER_CONFIG.get("ignore_main", False)
-    branch_mismatch = system_version != chosen_branch
-    looks_minty = re.compile(r"[a-z]+a").fullmatch(chosen_branch)
-
-    header = None
-    warning_prompt = None
-
-    system_exists = branch_exists(system_version)
-    chosen_exists = branch_exists(chosen_branch)
 
     # We only validate when the default remote is chosen -- if it's not we
     # cannot make any assumptions about branches
     if chosen_remote != DEFAULT_GIT_REMOTE:
-        logging.debug(
+        LOGGER.debug(
             "Not checking branches -- unsupported remote (%s) set",
             chosen_remote,
         )
-        return True
+        return
+
+    # Both lookups are network round-trips, so perform them at the same time
+    results = {}
+
+    def on_checked(key, exists):
+        results[key] = exists
+        if len(results) < 2:
+            return
+        if not warn_about_branch_settings(
+            parent, system_version, chosen_branch, results["system"], results["chosen"]
+        ):
+            LOGGER.warning("Non-optimal user branch settings.")
+
+    branch_exists_async(
+        system_version, functools.partial(on_checked, "system"), chosen_remote
+    )
+    branch_exists_async(
+        chosen_branch, functools.partial(on_checked, "chosen"), chosen_remote
+    )
+
+
+def warn_about_branch_settings(
+    parent, system_version, chosen_branch, system_exists, chosen_exists
+):
+    """
+    Shows a warning if the chosen branch is not a good match for the system.
+    :param parent: The parent GTK window for the warning dialog
+    :param system_version: The release name of the running distro
+    :param chosen_branch: The branch chosen in the settings
+    :param system_exists: Whether a branch for the running distro exists
+    :param chosen_exists: Whether the chosen branch exists
+    :returns: True if the settings are fine and False if a warning was shown
+    """
+
+    main_okay = USER_CONFIG.get("ignore_main", False)
+    branch_mismatch = system_version != chosen_branch
+    looks_minty = re.compile(r"[a-z]+a").fullmatch(chosen_branch)
+
+    header = None
+    warning_prompt = None
 
     # These are branches that should be handled specially
     if chosen_branch == "main" and system_exists and not main_okay:
@@ -893,29 +1140,151 @@ def validate_branch_settings(parent):
     return warning_prompt is None
 
 
-def branch_exists(branch_name):
+def _ls_remote_command(branch_name, remote_url):
     """
-    Checks whether a particular branch exists at the currently-configured
-    git URL.
-
+    Builds the command used to check whether a branch exists on a git URL.
     :param branch_name: The branch name to search for on the remote
-    :returns: True if the branch exists and False if it does not
+    :param remote_url: The git URL to search
+    :returns: The argument list for the command
     """
 
-    remote_url = USER_CONFIG["git_url"]
-    cmd = [
-        "/usr/bin/env",  # Use git wherever it is, don't depend on /usr/bin
-        "git",
+    return [
+        GIT_PATH,
         "ls-remote",  # ls-remote allows listing refs on a given remote
         "--heads",  # only list heads (branches, not tags/PRs)
         "--exit-code",  # Exit with status 2 if no matching refs are found
         remote_url,
         branch_name,  # Find refs with the same name as the branch we want
     ]
-    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=False)
-    logging.debug("ls-remote result for %s: %s", branch_name, output.stdout)
-    logging.debug("ls-remote code for %s: %s", branch_name, output.returncode)
-    return output.returncode == 0
+
+
+def _ls_remote_environment():
+    """
+    Builds the environment used when checking whether a branch exists.
+    :returns: A copy of the current environment for the command
+    """
+
+    # Fail immediately rather than waiting on a credential prompt when the
+    # remote does not exist or requires authentication
+    return {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+
+
+def is_recently_checked(cache, key):
+    """
+    Checks whether a successful check was recorded in a cache within the
+    last CHECK_CACHE_TTL seconds.
+    :param cache: The cache to look in
+    :param key: The key identifying the check
+    :returns: True if the check recently succeeded and False otherwise
+    """
+
+    checked_at = cache.get(key)
+    return checked_at is not None and time.monotonic() - checked_at < CHECK_CACHE_TTL
+
+
+def _branch_exists_http(branch_name, remote_url):
+    """
+    Checks whether a branch exists on a remote that supports git's smart
+    HTTP protocol by reading the remote's ref advertisement directly. This
+    avoids starting a git process.
+    :param branch_name: The branch name to search for on the remote
+    :param remote_url: The http:// or https:// git URL to search
+    :returns: True if the branch exists, False if it does not, or None if
+              the remote could not be queried this way
+    """
+
+    url = f"{remote_url.rstrip('/')}/info/refs?service=git-upload-pack"
+    # Any failure here (an invalid URL, a dropped connection, a malformed
+    # response, ...) just means falling back to git
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            content_type = response.headers.get_content_type()
+            if content_type != "application/x-git-upload-pack-advertisement":
+                return None
+            advertisement = response.read()
+    except (OSError, http.client.HTTPException, ValueError) as url_err:
+        LOGGER.debug("Unable to read refs from %s", url, exc_info=url_err)
+        return None
+
+    # Match the way git ls-remote matches patterns: a branch is found if the
+    # name matches the last part(s) of a ref under refs/heads/
+    wanted_tail = b"/" + branch_name.encode("utf-8")
+    # Each line is a pkt-line of the form "<length><object id> <ref>"; the
+    # first ref is also followed by a NUL and the server's capabilities
+    for line in advertisement.split(b"\n"):
+        ref = line.partition(b"\0")[0].rpartition(b" ")[2]
+        if ref.startswith(b"refs/heads/") and ref.endswith(wanted_tail):
+            return True
+    return False
+
+
+def branch_exists_async(branch_name, callback, remote_url=None):
+    """
+    Checks whether a particular branch exists at the currently-configured
+    git URL without blocking the GTK main loop.
+
+    :param branch_name: The branch name to search for on the remote
+    :param callback: Called from the main loop with True if the branch
+                     exists and False if it does not
+    :param remote_url: The git URL to search; defaults to the configured URL
+    """
+
+    if remote_url is None:
+        remote_url = USER_CONFIG["git_url"]
+    if is_recently_checked(BRANCH_CACHE, (remote_url, branch_name)):
+        GLib.idle_add(callback, True)
+        return
+
+    def on_exit(pid, status):
+        GLib.spawn_close_pid(pid)
+        returncode = os.waitstatus_to_exitcode(status)
+        LOGGER.debug("ls-remote code for %s: %s", branch_name, returncode)
+        if returncode == 0:
+            BRANCH_CACHE[(remote_url, branch_name)] = time.monotonic()
+        callback(returncode == 0)
+
+    def run_ls_remote():
+        try:
+            pid, _, _, _ = GLib.spawn_async(
+                _ls_remote_command(branch_name, remote_url),
+                envp=[f"{key}={value}" for key, value in _ls_remote_environment().items()],
+                flags=GLib.SpawnFlags.DO_NOT_REAP_CHILD
+                | GLib.SpawnFlags.STDOUT_TO_DEV_NULL,
+            )
+        except GLib.Error as error:
+            LOGGER.error("Unable to run git ls-remote.", exc_info=error)
+            GLib.idle_add(callback, False)
+            return
+        GLib.child_watch_add(GLib.PRIORITY_DEFAULT, pid, on_exit)
+
+    def on_http_checked(found):
+        LOGGER.debug("HTTP ref lookup for %s: %s", branch_name, found)
+        if found is None:
+            run_ls_remote()
+        else:
+            if found:
+                BRANCH_CACHE[(remote_url, branch_name)] = time.monotonic()
+            callback(found)
+        # Run only once when added as an idle callback
+        return GLib.SOURCE_REMOVE
+
+    if remote_url.startswith(("http://", "https://")):
+        # The HTTP request blocks, so make it from a worker thread and hand the
+        # result back to the main loop
+        def lookup_http():
+            # The result must always be delivered, otherwise the callback never
+            # runs and the window's controls are left disabled
+            found = None
+            try:
+                found = _branch_exists_http(branch_name, remote_url)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                LOGGER.error("HTTP ref lookup failed.", exc_info=error)
+            finally:
+                GLib.idle_add(on_http_checked, found)
+
+        threading.Thread(target=lookup_http, daemon=True).start()
+    else:
+        run_ls_remote()
 
 
 def display_ignorable_warning(title, message, parent, settings_key):
@@ -997,20 +1366,28 @@ def is_online(url="http://detectportal.firefox.com", expected=b"success\n"):
     :returns: True if able to connect or False otherwise.
     """
 
+    if is_recently_checked(ONLINE_CACHE, url):
+        return True
+
+    # Besides URLError, http.client can raise its own exceptions for dropped
+    # connections or malformed responses; all of them mean we aren't online
     try:
-        with urllib.request.urlopen(url) as response:
-            response_data = response.read()
+        # Only the first few bytes matter; reading one more than expected is
+        # enough to tell a longer response apart from the expected one
+        with urllib.request.urlopen(url, timeout=3) as response:
+            response_data = response.read(len(expected) + 1)
             if response_data == expected:
+                ONLINE_CACHE[url] = time.monotonic()
                 return True
-            logging.error(
+            LOGGER.error(
                 "Response from %s was not %s as expected. Received: %s",
                 url,
                 expected,
                 response_data,
             )
             return False
-    except urllib.error.URLError as url_err:
-        logging.error("Unable to connect to %s", url, exc_info=url_err)
+    except (OSError, http.client.HTTPException, ValueError) as url_err:
+        LOGGER.error("Unable to connect to %s", url, exc_info=url_err)
         return False
 
 
@@ -1021,16 +1398,17 @@ def write_user_config():
     """
 
     # Add all new roles to cummulative roles and also remove duplicates before
-    # writing -- must be a list since sets cannot be serialized with JSON
-    USER_CONFIG["roles_this_run"] = list(set(USER_CONFIG["roles_this_run"]))
-    USER_CONFIG["roles_all_time"] += USER_CONFIG["roles_this_run"]
-    # Since there could now be duplicates in roles_all_time, remove them
-    USER_CONFIG["roles_all_time"] = list(set(USER_CONFIG["roles_all_time"]))
+    # writing -- dict.fromkeys() keeps the original order so that the file
+    # does not change between runs when the roles have not
+    USER_CONFIG["roles_this_run"] = list(dict.fromkeys(USER_CONFIG["roles_this_run"]))
+    USER_CONFIG["roles_all_time"] = list(
+        dict.fromkeys(USER_CONFIG["roles_all_time"] + USER_CONFIG["roles_this_run"])
+    )
 
     config_path = (
         pathlib.Path(BaseDirectory.save_config_path("cs-vm-build")) / "settings.yml"
     )
-    logging.info("Writing user configuration %s to %s", USER_CONFIG, config_path)
+    LOGGER.info("Writing user configuration %s to %s", USER_CONFIG, config_path)
 
     write_json_config(config_path, USER_CONFIG)
 
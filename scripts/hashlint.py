@@ -4,33 +4,78 @@
 Simple script to validate the various hashes for downloads across the project.
 """
 
+import argparse
 import asyncio
 import hashlib
 import json
+import os
+import re
 import sys
+import time
 
 from collections import namedtuple
 from pathlib import Path
+from urllib.parse import urlsplit
 
 # Importing these types using in the string type hints is helpful for some
 # editors to actually support hinting for these types.
 # pylint: disable=unused-import
-from typing import Any, Dict, List, Set, Tuple, Type
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
 
 import aiohttp
-import jinja2
 import yaml
 
+# Use the much faster LibYAML-based loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+# uvloop is optional; it provides a faster event loop when it is installed
+try:
+    import uvloop
+except ImportError:
+    uvloop = None  # pylint: disable=invalid-name
+
 CACHE_FILE = Path.home() / ".cache" / "hashlint" / "cache.json"
+# How long a URL that has been validated against a hash is trusted without checking
+# it again
+VALIDATED_MAX_AGE = 30 * 24 * 60 * 60
+# The most to read from a response at once; in practice aiohttp hands over at most
+# 256 KiB (the size of its read buffer) per chunk
+CHUNK_SIZE = 1 << 20
+# Chunks at least this large are hashed in a worker thread; hashlib releases the
+# GIL while hashing them, so other downloads keep making progress in the meantime.
+# This is well below aiohttp's 256 KiB so most chunks of a large download qualify
+THREADED_HASH_SIZE = 64 * 1024
+MAX_CONCURRENT_DOWNLOADS = 8
+MAX_CONNECTIONS_PER_HOST = 4
+DNS_CACHE_TTL = 300
+# Algorithms that can be used in the vars files. The roles hand the hashes to
+# ansible.builtin.stat as its checksum_algorithm, which only accepts these
+HASH_ALGORITHMS = frozenset({"md5", "sha1", "sha224", "sha256", "sha384", "sha512"})
+# A bare Jinja variable reference, like "{{ ansible_architecture }}"
+TEMPLATE_VARIABLE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+# The start of any Jinja expression or statement
+TEMPLATE_MARKERS = ("{{", "{%")
 URLS = {
     "roles/eclipse/vars/main.yml": {
         "hash": "eclipse.hash",
         "urls": ["eclipse.url", "eclipse.url_backup"],
     },
 }
+# The dot-separated keys from URLS, split into their parts once at import
+URL_KEYS = {
+    file: {
+        "hash": tuple(lookup["hash"].split(".")),
+        "urls": [tuple(url.split(".")) for url in lookup["urls"]],
+    }
+    for file, lookup in URLS.items()
+}
 
 
-CheckData = namedtuple("CheckData", ["url", "expected_hash", "source_file"])
+# sources is a comma-separated list of the files that reference the URL and hash
+CheckData = namedtuple("CheckData", ["url", "expected_hash", "sources"])
 
 
 class CacheItem:
@@ -76,17 +121,32 @@ class CacheItem:
 
     @classmethod
     async def from_http_response(
-        cls, response: aiohttp.ClientResponse
+        cls, url: str, response: aiohttp.ClientResponse, algorithm: str
     ) -> "Type[CacheItem]":
         """
-        Parse a cache item from an HTTP response
+        Parse a cache item from an HTTP response to a request for the given URL,
+        hashing the body with the given hashlib algorithm.
+
+        The requested URL is stored rather than response.url since the latter is
+        the final URL after any redirects.
         """
         headers = response.headers
-        url = response.url
-        data = await response.read()
-        file_hash = hashlib.sha1(data).hexdigest()
-
-        return cls(url, headers.get("ETag"), headers.get("Last-Modified"), file_hash)
+        # Hash the body as it arrives rather than holding entire downloads, some
+        # of which are hundreds of megabytes, in memory
+        file_hash = hashlib.new(algorithm)
+        loop = asyncio.get_running_loop()
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if len(chunk) >= THREADED_HASH_SIZE:
+                await loop.run_in_executor(None, file_hash.update, chunk)
+            else:
+                file_hash.update(chunk)
+
+        return cls(
+            url,
+            headers.get("ETag"),
+            headers.get("Last-Modified"),
+            f"{algorithm}:{file_hash.hexdigest()}",
+        )
 
 
 class Cache:
@@ -95,25 +155,22 @@ class Cache:
     """
 
     def __init__(self):
-        self._items = []
+        self._items = {}
 
     def __getitem__(self, url):
-        return next(item for item in self._items if item.url == url)
+        return self._items[url]
 
     def __setitem__(self, url, item):
-        if matches := [cached for cached in self._items if cached.url == url]:
-            match = matches[0]
-            self._items.remove(match)
-        self._items.append(item)
+        self._items[url] = item
 
     def __bool__(self):
         return bool(self._items)
 
     def __contains__(self, url):
-        return bool([item for item in self._items if item.url == url])
+        return url in self._items
 
     def __iter__(self):
-        return iter([item.url for item in self._items])
+        return iter(self._items)
 
     def __repr__(self):
         return f"<Cache items={self._items!r}>"
@@ -124,7 +181,7 @@ class Cache:
         Load a cache from a dictionary.
         """
         cache = cls()
-        cache._items = list(CacheItem.from_json(data))
+        cache._items = {item.url: item for item in CacheItem.from_json(data)}
         return cache
 
     def to_json(self) -> Dict[str, Dict[str, str]]:
@@ -132,101 +189,229 @@ class Cache:
         Return the cache as a JSON serializable dictionary.
         """
         cache = {}
-        for item in self._items:
+        for item in self._items.values():
             cache.update(item.to_json())
         return cache
 
 
-def get_field(data: Dict[str, Dict[str, Any]], key: str) -> Any:
+def split_hash(value: str) -> Tuple[str, str]:
     """
-    Get a field from nested dictionary, with the field denoted with dot-separated keys.
+    Split a hash into its algorithm and hex digest.
 
-    For example, "a.b.c" -> data['a']['b']['c']
+    For example, "sha256:abc" -> ("sha256", "abc") and "abc" -> ("", "abc")
     """
 
-    keys = key.split(".")
+    algorithm, _, digest = value.rpartition(":")
+    return algorithm, digest
+
+
+def get_field(data: Dict[str, Dict[str, Any]], keys: Tuple[str, ...]) -> Any:
+    """
+    Get a field from nested dictionary, with the field denoted by a sequence of keys.
+
+    For example, ("a", "b", "c") -> data['a']['b']['c']
+    """
 
-    while keys:
-        data = data[keys.pop(0)]
+    for key in keys:
+        data = data[key]
 
     return data
 
 
-async def check_software_hash(
-    session: aiohttp.ClientSession, check_data: CheckData, cache: Cache
+async def is_unchanged(
+    session: aiohttp.ClientSession, url: str, cache_item: CacheItem
 ) -> bool:
     """
-    Checks the hash for the contents of a URL against an expected value.
+    Checks with a HEAD request whether the ETag or Last-Modified date for a URL still
+    match the cached values. Servers that don't provide either, or that reject or
+    time out HEAD requests, are treated as changed.
+    """
+
+    if not (cache_item.etag or cache_item.last_modified):
+        return False
+
+    try:
+        async with session.head(url, allow_redirects=True, timeout=60) as response:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+    if cache_item.etag and etag:
+        return etag == cache_item.etag
+    return bool(cache_item.last_modified) and last_modified == cache_item.last_modified
+
+
+async def fetch_cache_item(
+    session: aiohttp.ClientSession,
+    url: str,
+    cache_item: Optional[CacheItem],
+    algorithm: str,
+) -> Optional[CacheItem]:
+    """
+    Download a URL and hash its contents, using a conditional request if there is a
+    cached item for it. Returns the cached item if the server reports that the URL
+    has not been modified and None if the response cannot be used.
     """
 
     headers = {}
-    if check_data.url in cache:
-        cache_item = cache[check_data.url]
+    if cache_item:
         if cache_item.etag:
-            headers["If-None-Exists"] = cache_item.etag
+            headers["If-None-Match"] = cache_item.etag
         if cache_item.last_modified:
             headers["If-Modified-Since"] = cache_item.last_modified
 
-    try:
-        async with session.get(
-            check_data.url, headers=headers, timeout=600
-        ) as response:
-            if response.status == 200:
-                cache_item = await CacheItem.from_http_response(response)
-                cache[check_data.url] = cache_item
-    except aiohttp.ClientError:
-        print(
-            f"{check_data.source_file}: Unable to download {check_data.url}",
-            file=sys.stderr,
-        )
-        return False
+    async with session.get(url, headers=headers, timeout=600) as response:
+        if response.status == 200:
+            return await CacheItem.from_http_response(url, response, algorithm)
+        # 304 Not Modified means the cached hash is still correct; any other
+        # successful status leaves us without a hash to check
+        if response.status == 304:
+            return cache_item
+        return None
+
+
+async def check_software_hash(
+    session: aiohttp.ClientSession, check_data: CheckData, cache: Cache
+) -> bool:
+    """
+    Checks the hash for the contents of a URL against an expected value.
+    """
+
+    algorithm, expected_digest = split_hash(check_data.expected_hash)
+
+    # A cached hash can only be reused if it was computed with the same algorithm
+    cache_item = cache[check_data.url] if check_data.url in cache else None
+    if cache_item and split_hash(cache_item.hash)[0] != algorithm:
+        cache_item = None
 
-    sha1 = cache_item.hash
-    if sha1 != check_data.expected_hash:
+    # Only download the file if a HEAD request can't show that it is unchanged
+    if not (cache_item and await is_unchanged(session, check_data.url, cache_item)):
+        try:
+            cache_item = await fetch_cache_item(
+                session, check_data.url, cache_item, algorithm
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            print(
+                f"{check_data.sources}: Unable to download {check_data.url}",
+                file=sys.stderr,
+            )
+            return False
+
+        if cache_item is None:
+            print(
+                f"{check_data.sources}: Unexpected response downloading {check_data.url}",
+                file=sys.stderr,
+            )
+            return False
+        cache[check_data.url] = cache_item
+
+    _, digest = split_hash(cache_item.hash)
+    if digest != expected_digest:
         print(
-            f"{check_data.source_file}: Expected {check_data.expected_hash}. Found {sha1}",
+            f"{check_data.sources}: Expected {check_data.expected_hash}. Found {digest}",
             file=sys.stderr,
         )
         return False
 
     print(
-        f"{check_data.source_file}: Validated {sha1=} as expected from {check_data.url}"
+        f"{check_data.sources}: Validated {algorithm}={digest} as expected"
+        f" from {check_data.url}"
     )
 
     return True
 
 
+def validated_marker(check_data: CheckData) -> Path:
+    """
+    The path to the file that marks a URL as having been validated against its
+    expected hash. The hash is part of the name so changing it in the vars files
+    invalidates the marker.
+    """
+
+    url_hash = hashlib.sha1(check_data.url.encode("utf-8")).hexdigest()
+    algorithm, digest = split_hash(check_data.expected_hash)
+    return CACHE_FILE.parent / f"{url_hash}.{algorithm}-{digest}.ok"
+
+
+def is_recently_validated(check_data: CheckData) -> bool:
+    """
+    Checks whether the URL was validated against its expected hash recently enough
+    that it doesn't need to be checked again.
+    """
+
+    try:
+        age = time.time() - validated_marker(check_data).stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return age < VALIDATED_MAX_AGE
+
+
+def mark_validated(check_data: CheckData):
+    """
+    Record that the URL has been validated against its expected hash.
+    """
+
+    marker = validated_marker(check_data)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
+
+
+def is_template(source: str) -> bool:
+    """
+    Checks whether the string contains any Jinja expressions or statements.
+    """
+
+    return any(marker in source for marker in TEMPLATE_MARKERS)
+
+
 def process_variable(source: str, variable: str, value: str) -> str:
     """
     Process the string and substitute the variable and value.
+
+    Only plain references to the given variable are supported; any other variable,
+    filter or statement raises a KeyError.
     """
 
-    template = jinja2.Template(source)
-    return template.render(**{variable: value})
+    def substitute(match: "re.Match[str]") -> str:
+        if match.group(1) != variable:
+            raise KeyError(match.group(1))
+        return value
+
+    processed = TEMPLATE_VARIABLE.sub(substitute, source)
+    if is_template(processed):
+        raise KeyError(source)
+    return processed
 
 
-def urls_for_file(file: str, ansible_data: Dict[str, Any], lookup_data: Dict[str, Any]):
+def urls_for_file(
+    ansible_data: Dict[str, Any], lookup_data: Dict[str, Any]
+) -> Set[Tuple[str, str]]:
     """
-    Return a set of all URLs in the given file key in the URLs mapping.
+    Return a set of all URLs and their expected hashes in the given file key in the
+    URLs mapping.
     """
 
     hash_data = get_field(ansible_data, lookup_data["hash"])
-    if not isinstance(hash_data, dict):
-        # We never actually care about the architecture name, so forcing this
-        # to be a dictionary is a useful way to make the code cleaner later
-        hash_data = {"_": hash_data}
 
     # Pull the unprocessed URLs from the Ansible variables; the assumption is that the
     # only jinja2-looking part of the URL, if there is one, is the `ansible_architecture`
-    # which should be fine since `{{ }}` probably won't be in a URL and jinja2 is perfectly
-    # content to be given templates that don't contain a given variable
+    # which should be fine since `{{ }}` probably won't be in a URL
     raw_urls = [get_field(ansible_data, url_path) for url_path in lookup_data["urls"]]
 
+    if not isinstance(hash_data, dict):
+        # A single hash means the download is the same for every architecture, so
+        # there is nothing to substitute; a templated URL would make no sense
+        for url in raw_urls:
+            if is_template(url):
+                raise KeyError(url)
+        return {(url, hash_data) for url in raw_urls}
+
     checks = set()
     for url in raw_urls:
         for arch, expected_hash in hash_data.items():
             new_url = process_variable(url, "ansible_architecture", arch)
-            checks.add(CheckData(new_url, expected_hash, file))
+            checks.add((new_url, expected_hash))
     return checks
 
 
@@ -245,55 +430,125 @@ def write_cache(cache: Cache):
     Save the cache to disk.
     """
     CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(CACHE_FILE, "w", encoding="utf-8") as cache_file:
-        json.dump(cache.to_json(), cache_file, indent=4)
+    # Write to a temporary file and move it into place so that an interrupted run
+    # cannot leave a corrupt cache behind
+    temp_file = CACHE_FILE.with_suffix(".tmp")
+    with open(temp_file, "w", encoding="utf-8") as cache_file:
+        json.dump(cache.to_json(), cache_file, separators=(",", ":"))
+    os.replace(temp_file, CACHE_FILE)
 
 
-def get_urls() -> Tuple[Set[str], int]:
+def load_vars_file(file: str) -> Dict[str, Any]:
+    """
+    Load an Ansible vars file.
+    """
+    with open(file, encoding="utf-8") as software_data_file:
+        return yaml.load(software_data_file, Loader=SafeLoader)
+
+
+async def get_urls() -> Tuple[List[CheckData], int]:
     """
     Load the list of URLs to validate hashes for as well as the number of errors
     encountered parsing the list.
+
+    A URL and hash referenced from several files is only checked once.
     """
     errors = 0
-    to_check = set()
-    for file, hash_data in URLS.items():
-        with open(file, encoding="utf-8") as software_data_file:
-            software_data = yaml.safe_load(software_data_file)
+    sources = {}
+    # The files are independent, so read and parse them all at once
+    all_software_data = await asyncio.gather(
+        *(asyncio.to_thread(load_vars_file, file) for file in URL_KEYS)
+    )
+    for (file, hash_data), software_data in zip(URL_KEYS.items(), all_software_data):
         try:
-            to_check |= urls_for_file(file, software_data, hash_data)
+            checks = urls_for_file(software_data, hash_data)
         except KeyError:
             print(f"{file}: File does not meet expected structure")
             errors += 1
+            continue
+        # The roles pass the hashes to get_url as checksums, so they must use its
+        # "<algorithm>:<digest>" format
+        algorithms = {split_hash(expected_hash)[0] for _, expected_hash in checks}
+        if "" in algorithms:
+            print(f"{file}: Hashes must be in <algorithm>:<digest> form")
+            errors += 1
+            continue
+        # Catch typos and algorithms the roles can't use here rather than failing
+        # partway through a download or in the middle of a playbook run
+        unsupported = algorithms - HASH_ALGORITHMS
+        if unsupported:
+            print(f"{file}: Unsupported hash algorithm {', '.join(sorted(unsupported))}")
+            errors += 1
+            continue
+        for check in checks:
+            sources.setdefault(check, []).append(file)
+
+    to_check = [
+        CheckData(url, expected_hash, ", ".join(files))
+        for (url, expected_hash), files in sources.items()
+    ]
     return to_check, errors
 
 
-async def main():
+async def main(use_cache: bool = True, fail_fast: bool = False):
     """
     Main
     """
 
-    cache = load_cache()
+    # Reading the cache and the vars files are both local IO, so overlap them
+    cache, (to_check, errors) = await asyncio.gather(
+        asyncio.to_thread(load_cache), get_urls()
+    )
     print(f"Cache loaded: {cache}")
 
-    to_check, errors = get_urls()
-
     # User-Agent is the same as used by Ansible itself
     # https://github.com/ansible/ansible/blob/062e780a68f9acd2ee6f824f252458b8a0351f24/lib/ansible/modules/get_url.py#L167
     # This is particularly relevant for Finch, which will throw a 403 when
     # downloading using the default User-Agent.
     headers = {"User-Agent": "ansible-httpget"}
-    async with aiohttp.ClientSession(headers=headers, raise_for_status=True) as session:
+    # Limit the number of downloads in flight so that a long list of URLs does not
+    # saturate the network
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    async def limited_check(session, check_data):
+        if use_cache and is_recently_validated(check_data):
+            print(f"{check_data.sources}: Recently validated {check_data.url}")
+            return True
+        async with semaphore:
+            valid = await check_software_hash(session, check_data, cache)
+        if valid and use_cache:
+            mark_validated(check_data)
+        return valid
+
+    # Keep connections and DNS lookups around so that URLs on the same host, such
+    # as one download for each architecture, can reuse them
+    connector = aiohttp.TCPConnector(
+        limit=2 * MAX_CONCURRENT_DOWNLOADS,
+        limit_per_host=MAX_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    async with aiohttp.ClientSession(
+        connector=connector, headers=headers, raise_for_status=True
+    ) as session:
+        # Start the checks grouped by host so that a finished download's connection
+        # is likely to be picked up by the next check for the same host
         tasks = [
-            asyncio.create_task(check_software_hash(session, check_data, cache))
-            for check_data in to_check
+            asyncio.create_task(limited_check(session, check_data))
+            for check_data in sorted(
+                to_check, key=lambda check: (urlsplit(check.url).netloc, check.url)
+            )
         ]
-        # The gather must occur within the `with` otherwise the session may be closed
-        # when the threads attempt to use it to download the file
-        for result in await asyncio.gather(*tasks):
-            # This relies on the fact that True gets coerced to 1 and that False gets
-            # coerced to 0 when converted to an integer. The check method returns True
-            # on success and we need to count failures.
-            errors += not result
+        # The waiting must occur within the `with` otherwise the session may be closed
+        # when the tasks attempt to use it to download the file
+        for finished in asyncio.as_completed(tasks):
+            if await finished:
+                continue
+            errors += 1
+            if fail_fast:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                break
 
     write_cache(cache)
     print(f"Wrote cache: {cache}")
@@ -301,4 +556,18 @@ async def main():
 
 
 if __name__ == "__main__":
-    sys.exit(asyncio.run(main()))
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Skip URLs that were recently validated against the same hash",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop checking the remaining URLs after the first failure",
+    )
+    args = parser.parse_args()
+    run = uvloop.run if uvloop else asyncio.run
+    sys.exit(run(main(use_cache=args.cache, fail_fast=args.fail_fast)))
@@ -7,12 +7,11 @@ request and passing it to packer. It also makes a best-guess effort at
 determining the proper host audio device to select.
 """
 
-import json
-import os
+import concurrent.futures
 import platform
+import shlex
 import subprocess
 import sys
-import tempfile
 
 from typing import Dict, List, Tuple
 
@@ -96,20 +95,20 @@ def determine_pr_clone_info(pull_request: github.PullRequest.PullRequest) -> Tup
     return pull_request.head.repo.clone_url, pull_request.head.ref
 
 
-def write_var_file(output_file, clone_info: Tuple[str, str], audio: str):
+def build_pr_variables(clone_info: Tuple[str, str], audio: str) -> Dict[str, str]:
     """
-    Write the packer var file configuration.
+    Build the packer variables for testing the pull request.
     """
 
     pr_config = {}
     pr_config["audio"] = audio
     pr_config["git_repo"] = clone_info[0]
     pr_config["git_branch"] = clone_info[1]
-    json.dump(pr_config, output_file, indent=4)
+    return pr_config
 
 
 def build_packer_command(
-    packer_cmd: str, var_files: str, pr_var_file: str, template: str
+    packer_cmd: str, var_files: str, pr_variables: Dict[str, str], template: str
 ) -> List[str]:
     """
     Build the array of arguments needed to invoke packer.
@@ -118,7 +117,10 @@ def build_packer_command(
     command = [packer_cmd, "build"]
     for filename in var_files:
         command.append(f"-var-file={filename}")
-    command.append(f"-var-file={pr_var_file}")
+    # Passed directly rather than in a var file so that there is no temporary file to
+    # clean up, and so that the echoed command can be run again as is
+    for name, value in pr_variables.items():
+        command.append(f"-var={name}={value}")
     command.append(template)
     return command
 
@@ -183,9 +185,14 @@ def main(
     CONFIG["QUIET_MODE"] = not interactive
     CONFIG["BASE_REPO"] = base_repo
 
+    api_auth = build_authentication_info(github_access_token)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        pr_lookup = executor.submit(lookup_pull_request, pull_request_id, **api_auth)
+        # Picking the audio device is local work, so do it while waiting on the API
+        audio_device = determine_audio_setting()
+
     try:
-        api_auth = build_authentication_info(github_access_token)
-        pull_request = lookup_pull_request(pull_request_id, **api_auth)
+        pull_request = pr_lookup.result()
     except github.RateLimitExceededException:
         click.echo("Exceeded Github rate limit. Please try authenticating.", err=True)
         return 1
@@ -199,22 +206,15 @@ def main(
         return 1
 
     clone_data = determine_pr_clone_info(pull_request)
-    audio_device = determine_audio_setting()
-
-    # We can't delete the file when we're done with it since packer needs it; however, it
-    # is important that we close it so that other processes can open.
-    with tempfile.NamedTemporaryFile("w+", suffix=".json", delete=False) as config_file:
-        write_var_file(config_file, clone_data, audio_device)
 
-    packer_args = build_packer_command(packer_cmd, var_file, config_file.name, template_file)
-    click.echo(f"Command: {' '.join(packer_args)}")
+    pr_variables = build_pr_variables(clone_data, audio_device)
+    packer_args = build_packer_command(packer_cmd, var_file, pr_variables, template_file)
+    click.echo(f"Command: {shlex.join(packer_args)}")
     if CONFIG["QUIET_MODE"] or click.confirm("Execute command?", default=True):
         try:
             subprocess.run(packer_args, check=True)
         except subprocess.CalledProcessError:
             return 1
-        finally:
-            os.remove(config_file.name)
 
     return 0
 